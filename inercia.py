@@ -1,7 +1,13 @@
 import yfinance as yf
 import pandas as pd
 import numpy as np
-from datetime import datetime
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo
+from numpy.lib.stride_tricks import sliding_window_view
 
 ETFS = ["XLK", "XLV", "XLF", "XLY", "XLC", "XLI", "XLP", "XLE", "XLU", "XLRE", "XLB", "IEF"]
 BENCHMARK = "SPY"
@@ -10,27 +16,97 @@ BENCHMARK = "SPY"
 N = 8   # ROC3 período
 M = 10  # ROC4 período
 
+# Histórico para el cálculo en tiempo real. El ATR de Wilder (alpha=1/14)
+# arrastra su arranque: con 96 meses su peso residual es < 0.3%
+MESES_HISTORIA = 96
 
-def calcular_atr_wilder(high, low, close, period=14):
+# Columnas que usa la Inercia Alcista: Open y Volume se descartan al descargar
+COLUMNAS = ['High', 'Low', 'Close']
+
+# Caché en disco de las series mensuales descargadas (Parquet)
+CACHE_DIR = Path(".cache")
+
+# Barras cacheadas que se vuelven a pedir al completar la caché; la más
+# antigua ancla el factor de reajuste (las recientes aún pueden revisarse)
+BARRAS_SOLAPE = 5
+
+# Zona horaria del mercado: decide qué sesiones están cerradas
+ZONA_MERCADO = ZoneInfo("America/New_York")
+
+# Memo en proceso de las descargas de yfinance (válido durante el día UTC)
+_CACHE_DESCARGAS = {}
+
+# Memo en proceso del ranking actual, por día UTC (cambia una vez por cierre)
+_CACHE_INERCIA_MENSUAL = {}
+
+# Memo en proceso de la inercia histórica del backtest, por versión de datos
+_CACHE_INERCIA = {}
+
+# Memo en proceso del backtest completo (TOP 2 y TOP 3), por día UTC
+_CACHE_BACKTEST = {}
+
+
+def _envolver(valores, referencia):
     """
-    Calcula el ATR usando Wilder's Smoothing (exacto como Amibroker).
-    
-    Wilder's ATR:
-    - Primer valor: SMA de los primeros N True Ranges
-    - Siguientes: ATR = ATR_prev * (N-1)/N + TR * 1/N
+    Envuelve un ndarray con el índice de la referencia.
+    Acepta Series (un ticker) o DataFrame (una columna por ticker).
     """
-    # Calcular True Range
-    tr1 = high - low
-    tr2 = (high - close.shift(1)).abs()
-    tr3 = (low - close.shift(1)).abs()
+    if isinstance(referencia, pd.DataFrame):
+        return pd.DataFrame(valores, index=referencia.index, columns=referencia.columns)
+    return pd.Series(valores, index=referencia.index)
+
+
+def _desplazar(x, periodo):
+    """Equivalente a .shift(periodo) sobre un ndarray (eje 0, relleno NaN)."""
+    desplazado = np.full_like(x, np.nan)
+    if periodo < len(x):
+        desplazado[periodo:] = x[:len(x) - periodo]
+    return desplazado
+
+
+def _atr_wilder(h, l, c, period=14):
+    """ATR de Wilder sobre ndarrays (1-D o meses x tickers). Ver calcular_atr_wilder."""
+    # np.fmax ignora NaN igual que .max(axis=1): en la primera barra TR = H - L
+    c_prev = _desplazar(c, 1)
+    true_range = np.fmax.reduce([h - l, np.abs(h - c_prev), np.abs(l - c_prev)])
+    
+    # Wilder's smoothing usando EWM con alpha = 1/period: misma recursión que
+    # el ATR de Amibroker, salvo el arranque (ver calcular_atr_wilder)
+    tr = pd.DataFrame(true_range) if true_range.ndim == 2 else pd.Series(true_range)
+    return tr.ewm(alpha=1/period, min_periods=period, adjust=False).mean().to_numpy()
+
+
+def _sma(x, period=14):
+    """SMA sobre ndarrays (1-D o meses x tickers). Ver calcular_sma."""
+    x = x.astype(float)
+    sma = np.full_like(x, np.nan)
+    
+    if len(x) >= period:
+        sma[period - 1:] = sliding_window_view(x, period, axis=0).mean(axis=-1)
     
-    true_range = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
+    return sma
+
+
+def _roc(x, periodo):
+    """ROC en porcentaje sobre ndarrays. Ver calcular_roc."""
+    return (x / _desplazar(x, periodo) - 1) * 100
+
+
+def calcular_atr_wilder(high, low, close, period=14):
+    """
+    Calcula el ATR usando Wilder's Smoothing (la recursión de Amibroker).
     
-    # Wilder's smoothing usando EWM con alpha = 1/period
-    # Esto replica exactamente el ATR de Amibroker
-    atr = true_range.ewm(alpha=1/period, min_periods=period, adjust=False).mean()
+    Wilder's ATR = EWM con alpha = 1/N y adjust=False, calculado en una sola
+    pasada en C por pandas (sin ventana rolling):
+    - Arranque: la recursión parte del primer True Range
+    - Siguientes: ATR = ATR_prev * (N-1)/N + TR * 1/N
+    - Los N-1 primeros valores son NaN (min_periods=N)
     
-    return atr
+    El arranque difiere del de Amibroker (SMA de los N primeros TR), pero su
+    peso decae como ((N-1)/N)^k y es despreciable tras unos años de histórico.
+    """
+    atr = _atr_wilder(high.to_numpy(), low.to_numpy(), close.to_numpy(), period)
+    return _envolver(atr, close)
 
 
 def calcular_ma_wilder(serie, period=14):
@@ -41,13 +117,22 @@ def calcular_ma_wilder(serie, period=14):
     return serie.ewm(alpha=1/period, min_periods=period, adjust=False).mean()
 
 
+def calcular_sma(serie, period=14):
+    """
+    Media Móvil Simple sobre ventanas deslizantes (sliding_window_view).
+    Equivale a serie.rolling(period).mean(): cualquier NaN en la ventana da NaN.
+    Cada ventana se suma de forma independiente, sin arrastrar errores de
+    redondeo de una suma acumulada.
+    """
+    return _envolver(_sma(serie.to_numpy(), period), serie)
+
+
 def calcular_roc(serie, periodo):
     """
     Calcula ROC igual que Amibroker: ((C - C[n]) / C[n]) * 100
     Retorna el valor en PORCENTAJE.
     """
-    roc = ((serie - serie.shift(periodo)) / serie.shift(periodo)) * 100
-    return roc
+    return _envolver(_roc(serie.to_numpy(), periodo), serie)
 
 
 def descargar_datos_mensuales(ticker, start="2000-01-01", end=None):
@@ -75,23 +160,305 @@ def descargar_datos_mensuales(ticker, start="2000-01-01", end=None):
         if isinstance(df.columns, pd.MultiIndex):
             df = df.droplevel(1, axis=1)
         
-        # Resamplear a mensual
-        # Usamos 'ME' (Month End) para incluir todos los datos hasta hoy
-        df_monthly = df.resample('ME').agg({
-            'Open': 'first',
-            'High': 'max',
-            'Low': 'min',
-            'Close': 'last',
-            'Volume': 'sum'
-        }).dropna()
-        
-        return df_monthly
+        return resamplear_mensual(df[COLUMNAS])
         
     except Exception as e:
         print(f"❌ Error descargando {ticker}: {e}")
         return None
 
 
+def _ruta_cache(ticker, start, interval="1d"):
+    """Ruta del fichero Parquet cacheado para (ticker, start, interval)."""
+    return CACHE_DIR / f"{ticker}_{start}_{interval}.parquet"
+
+
+def leer_cache(ticker, start, interval="1d"):
+    """
+    Lee las barras diarias cacheadas de un ticker.
+    Retorna None si no existen o no se pueden leer.
+    """
+    ruta = _ruta_cache(ticker, start, interval)
+    if not ruta.exists():
+        return None
+    
+    try:
+        df = pd.read_parquet(ruta)
+    except Exception as e:
+        print(f"⚠️ {ticker}: Caché ilegible ({e})")
+        return None
+    
+    faltan = [c for c in COLUMNAS if c not in df.columns]
+    if faltan:
+        print(f"⚠️ {ticker}: Caché incompleta (faltan {', '.join(faltan)})")
+        return None
+    
+    return df[COLUMNAS] if not df.empty else None
+
+
+def guardar_cache(df, ticker, start, interval="1d"):
+    """
+    Guarda las barras en la caché Parquet (zstd). Errores no fatales.
+    
+    Solo se guardan las sesiones con al menos un día hábil completo de
+    antigüedad en hora de Nueva York: la de hoy puede seguir abierta (si la
+    hora local va por delante de la sesión de EE. UU.) y la última cerrada
+    aún puede ser revisada por Yahoo tras el cierre.
+    """
+    hoy_mercado = pd.Timestamp(datetime.now(ZONA_MERCADO).date())
+    corte = hoy_mercado - pd.offsets.BDay(1)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        df[df.index < corte].to_parquet(_ruta_cache(ticker, start, interval), compression='zstd')
+    except Exception as e:
+        print(f"⚠️ {ticker}: No se pudo guardar la caché ({e})")
+
+
+def completar_cache(cacheados, end):
+    """
+    Descarga solo la cola de los tickers cacheados (una llamada conjunta desde
+    las últimas BARRAS_SOLAPE barras guardadas) y la une al histórico.
+    
+    Las barras del solape se vuelven a pedir: con auto_adjust, un dividendo o
+    split nuevo reajusta todo el histórico de Yahoo, y el cociente entre
+    ambos cierres es justo el factor para reescalar la caché. El factor se
+    ancla en la barra más antigua del solape, no en la última: una revisión
+    de la barra más reciente no debe confundirse con un reajuste.
+    Las barras del solape se sustituyen por las recién descargadas.
+    
+    Retorna {ticker: df_diario}. Los tickers sin solape (o con un cierre
+    ancla NaN) no se incluyen y deben descargarse completos.
+    """
+    anclas = {t: df.index[-min(BARRAS_SOLAPE, len(df))] for t, df in cacheados.items()}
+    desde = min(anclas.values())
+    cola = descargar_lote(
+        list(cacheados),
+        start=desde.strftime("%Y-%m-%d"),
+        end=end,
+        interval="1d"
+    )
+    
+    diarios = {}
+    for ticker, df_cache in cacheados.items():
+        df_cola = cola.get(ticker)
+        ancla = anclas[ticker]
+        if df_cola is None or ancla not in df_cola.index:
+            continue
+        
+        factor = df_cola.at[ancla, 'Close'] / df_cache.at[ancla, 'Close']
+        if not np.isfinite(factor) or factor <= 0:
+            # Cierre ancla ausente (NaN) o inválido: no se puede reescalar sin
+            # corromper la caché; se descarga completo como si no hubiera solape
+            print(f"⚠️ {ticker}: Solape sin cierre válido, se descarga completo")
+            continue
+        
+        if not np.isclose(factor, 1.0, rtol=1e-7, atol=0):
+            print(f"🔧 {ticker}: Histórico reajustado por Yahoo (x{factor:.6f})")
+            df_cache = df_cache * factor
+        
+        diarios[ticker] = pd.concat([df_cache[df_cache.index < ancla], df_cola[df_cola.index >= ancla]])
+    
+    return diarios
+
+
+def descargar_con_reintentos(ticker, start="2000-01-01", end=None, intentos=3, espera=1.0):
+    """
+    Descarga un ticker reintentando con backoff exponencial (1s, 2s, 4s...).
+    Protege frente a errores puntuales y rate-limits (HTTP 429) de Yahoo.
+    """
+    for intento in range(intentos):
+        df = descargar_datos_mensuales(ticker, start=start, end=end)
+        if df is not None:
+            return df
+        if intento < intentos - 1:
+            time.sleep(espera * 2 ** intento)
+    return None
+
+
+def descargar_lote(tickers, **kwargs):
+    """
+    Descarga varios tickers en UNA sola llamada a yfinance.
+    Los kwargs (start/end/period/interval) se pasan tal cual a yf.download.
+    
+    Las descargas se memorizan en memoria durante el día UTC: llamadas
+    repetidas en el mismo proceso (p. ej. cálculo + envío a Telegram) no
+    repiten la petición HTTP. Las de días anteriores se descartan, y un lote
+    al que le falte algún ticker no se memoriza (se reintenta en la
+    siguiente llamada).
+    
+    Solo se conservan las COLUMNAS que usa el indicador.
+    
+    Retorna un dict {ticker: df} sin las filas vacías de cada ticker.
+    """
+    tickers = list(tickers)
+    hoy_utc = datetime.now(timezone.utc).date()
+    clave = (tuple(tickers), tuple(sorted(kwargs.items())), hoy_utc)
+    if clave in _CACHE_DESCARGAS:
+        return dict(_CACHE_DESCARGAS[clave])
+    
+    try:
+        df_all = yf.download(
+            tickers,
+            group_by="ticker",
+            threads=True,
+            progress=False,
+            auto_adjust=True,
+            **kwargs
+        )
+    except Exception as e:
+        print(f"❌ Error descargando {', '.join(tickers)}: {e}")
+        return {}
+    
+    lote = {}
+    if df_all.empty:
+        return lote
+    
+    disponibles = set(df_all.columns.get_level_values(0))
+    for ticker in tickers:
+        if ticker not in disponibles:
+            continue
+        
+        # Las filas previas al inicio de cotización del ticker vienen a NaN
+        df = df_all[ticker][COLUMNAS].dropna(how='all')
+        if not df.empty:
+            lote[ticker] = df
+    
+    # Acotar memoria (p. ej. start_bot en marcha): descartar días anteriores.
+    # pop tolera que el otro hilo de descargar_datos_mensuales_recientes
+    # ya lo haya borrado
+    for anterior in list(_CACHE_DESCARGAS):
+        if anterior[-1] < hoy_utc:
+            _CACHE_DESCARGAS.pop(anterior, None)
+    
+    if len(lote) == len(tickers):
+        _CACHE_DESCARGAS[clave] = lote
+    return dict(lote)
+
+
+def descargar_datos_mensuales_recientes(tickers, meses=MESES_HISTORIA, hoy=None):
+    """
+    Descarga barras mensuales nativas de Yahoo (interval='1mo') para el
+    cálculo en tiempo real: ~21x menos filas que bajar diario y resamplear.
+    Solo se piden los últimos 'meses' (ventana fija, no crece con los años).
+    
+    El mes en curso se reconstruye con una segunda descarga diaria pequeña
+    (period='1mo'), igual que haría resamplear_mensual. La sesión de hoy se
+    excluye, como con end=hoy en el backtest: durante el mercado aún está
+    abierta.
+    
+    Retorna un dict {ticker: df_mensual} indexado a fin de mes, como 'ME'.
+    """
+    if hoy is None:
+        hoy = datetime.now()
+    
+    mes_actual = pd.Period(hoy, 'M')
+    hoy_dia = pd.Timestamp(hoy.date())
+    start = (mes_actual - meses).start_time.strftime("%Y-%m-%d")
+    
+    # Ambas descargas son independientes: se lanzan a la vez (solo I/O)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futuro_mensual = executor.submit(descargar_lote, tickers, start=start, interval="1mo")
+        futuro_diario = executor.submit(descargar_lote, tickers, period="1mo", interval="1d")
+        mensual = futuro_mensual.result()
+        diario = futuro_diario.result()
+    
+    datos = {}
+    for ticker, df in mensual.items():
+        periodos = df.index.to_period('M')
+        df = precios_float32(df[periodos < mes_actual].dropna())
+        df.index = df.index.to_period('M').to_timestamp(how='end').normalize()
+        
+        if ticker in diario:
+            df_dia = diario[ticker]
+            en_curso = (df_dia.index.to_period('M') == mes_actual) & (df_dia.index < hoy_dia)
+            df_dia = df_dia[en_curso]
+            if not df_dia.empty:
+                df = pd.concat([df, resamplear_mensual(df_dia)])
+        
+        if not df.empty:
+            datos[ticker] = df
+    
+    return datos
+
+
+def descargar_datos_mensuales_batch(tickers, start="2000-01-01", end=None):
+    """
+    Descarga varios tickers en UNA sola llamada a yfinance y resamplea a mensual.
+    Evita una petición HTTP por ticker; yfinance paraleliza internamente.
+    
+    Los tickers que falten en la descarga conjunta se reintentan de forma
+    individual y concurrente (ThreadPoolExecutor), conservando el control de
+    errores por ticker.
+    
+    Las barras diarias se guardan en una caché Parquet (CACHE_DIR) por
+    (ticker, start, interval): en las siguientes ejecuciones solo se descarga
+    la cola desde la última barra guardada (ver completar_cache).
+    
+    Retorna un dict {ticker: df_mensual}. Los tickers sin datos no se incluyen.
+    """
+    if end is None:
+        end = datetime.now().strftime("%Y-%m-%d")
+    
+    cacheados = {}
+    for ticker in tickers:
+        df_cache = leer_cache(ticker, start)
+        if df_cache is not None:
+            cacheados[ticker] = df_cache
+    
+    diarios = completar_cache(cacheados, end) if cacheados else {}
+    
+    nuevos = [t for t in tickers if t not in diarios]
+    if nuevos:
+        diarios.update(descargar_lote(nuevos, start=start, end=end, interval="1d"))
+    
+    datos = {}
+    for ticker, df in diarios.items():
+        guardar_cache(df, ticker, start)
+        
+        df_monthly = resamplear_mensual(df[df.index < pd.Timestamp(end)])
+        if not df_monthly.empty:
+            datos[ticker] = df_monthly
+    
+    faltantes = [t for t in tickers if t not in datos]
+    if faltantes:
+        print(f"🔁 Reintentando individualmente: {', '.join(faltantes)}")
+        with ThreadPoolExecutor(max_workers=len(faltantes)) as executor:
+            descargas = executor.map(
+                lambda t: descargar_con_reintentos(t, start=start, end=end),
+                faltantes
+            )
+            for ticker, df_monthly in zip(faltantes, descargas):
+                if df_monthly is not None and not df_monthly.empty:
+                    datos[ticker] = df_monthly
+    
+    return datos
+
+
+def resamplear_mensual(df):
+    """
+    Resamplea barras diarias (High/Low/Close) a mensuales.
+    Agrupa por mes (PeriodIndex) con una reducción por columna, evitando la
+    ruta lenta de resample('ME').agg(dict). El índice queda a fin de mes,
+    igual que con 'ME', e incluye todos los datos hasta hoy.
+    """
+    g = df.groupby(df.index.to_period('M'))
+    df_monthly = pd.DataFrame({
+        'High': g['High'].max(),
+        'Low': g['Low'].min(),
+        'Close': g['Close'].last()
+    }).dropna()
+    df_monthly.index = df_monthly.index.to_timestamp(how='end').normalize()
+    
+    return precios_float32(df_monthly)
+
+
+def precios_float32(df):
+    """
+    Reduce los precios a float32: la mitad de bytes en los indicadores
+    y precisión más que suficiente para el ranking.
+    """
+    return df.astype(np.float32)
+
+
 def calcular_inercia_alcista(df_monthly):
     """
     Calcula la Inercia Alcista EXACTAMENTE como Amibroker.
@@ -105,25 +472,32 @@ def calcular_inercia_alcista(df_monthly):
     ATR14 = ATR(14);        ← Usa Wilder's Smoothing
     F2 = (ATR14 / MA(C, 14)) * 0.4;
     InerciaAlcista = F1 / F2;
+    
+    Acepta un ticker (columnas High/Low/Close) o un panel con columnas (campo, ticker):
+    en ese caso todas las series son DataFrames y se calcula en una sola pasada.
     """
     close = df_monthly['Close']
-    high = df_monthly['High']
-    low = df_monthly['Low']
+    
+    # Todo el cálculo sobre ndarrays (sin alinear índices en cada operación);
+    # solo se vuelve a Series/DataFrame al devolver
+    c = close.to_numpy()
+    h = df_monthly['High'].to_numpy()
+    l = df_monthly['Low'].to_numpy()
     
     # ROC3 = ROC(C, N) * 0.4  (N=8)
-    roc3 = calcular_roc(close, N) * 0.4
+    roc3 = _roc(c, N) * 0.4
     
     # ROC4 = ROC(C, M) * 0.2  (M=10)
-    roc4 = calcular_roc(close, M) * 0.2
+    roc4 = _roc(c, M) * 0.2
     
     # F1 = ROC3 + ROC4 (numerador)
     f1 = roc3 + roc4
     
     # ATR14 = ATR(14) con Wilder's Smoothing
-    atr14 = calcular_atr_wilder(high, low, close, period=14)
+    atr14 = _atr_wilder(h, l, c, period=14)
     
     # MA(C, 14) - Media móvil simple estándar
-    ma14 = close.rolling(window=14).mean()
+    ma14 = _sma(c, period=14)
     
     # F2 = (ATR14 / MA(C, 14)) * 0.4 (denominador)
     f2 = (atr14 / ma14) * 0.4
@@ -131,6 +505,10 @@ def calcular_inercia_alcista(df_monthly):
     # InerciaAlcista = F1 / F2
     inercia_alcista = f1 / f2
     
+    inercia_alcista, roc3, roc4, f1, f2, atr14, ma14 = (
+        _envolver(x, close) for x in (inercia_alcista, roc3, roc4, f1, f2, atr14, ma14)
+    )
+    
     return inercia_alcista, roc3, roc4, f1, f2, atr14, ma14
 
 
@@ -138,7 +516,33 @@ def calcular_inercia_mensual():
     """
     Calcula la Inercia Alcista actual para cada ETF.
     Incluye el mes en curso (como si hoy fuera fin de mes).
+    
+    El resultado se memoriza por día UTC: llamadas repetidas el mismo día
+    (workflow + envío a Telegram) no repiten descarga ni cálculo. Solo se
+    memoriza si todos los ETFs tienen valor.
     """
+    hoy_utc = datetime.now(timezone.utc).date()
+    if hoy_utc in _CACHE_INERCIA_MENSUAL:
+        print(f"♻️ Inercia Alcista ya calculada hoy ({hoy_utc.strftime('%d/%m/%Y')} UTC)")
+        return list(_CACHE_INERCIA_MENSUAL[hoy_utc])
+    
+    resultados = _calcular_inercia_mensual()
+    
+    # Acotar memoria: descartar entradas de hace más de 2 días
+    for dia in list(_CACHE_INERCIA_MENSUAL):
+        if dia < hoy_utc - timedelta(days=2):
+            del _CACHE_INERCIA_MENSUAL[dia]
+    
+    # Solo un ranking completo: si falló algún ETF, la siguiente llamada del
+    # día vuelve a intentarlo (descargar_lote tampoco memoriza lotes parciales)
+    if len(resultados) == len(ETFS):
+        _CACHE_INERCIA_MENSUAL[hoy_utc] = resultados
+    
+    return list(resultados)
+
+
+def _calcular_inercia_mensual():
+    """Cálculo sin memoizar de calcular_inercia_mensual."""
     resultados = []
     
     hoy = datetime.now()
@@ -147,9 +551,11 @@ def calcular_inercia_mensual():
     print(f"📈 ATR: Wilder's Smoothing (14 períodos)")
     print()
     
+    datos = descargar_datos_mensuales_recientes(ETFS, hoy=hoy)
+    
     for ticker in ETFS:
         try:
-            df_monthly = descargar_datos_mensuales(ticker, start="2018-01-01")
+            df_monthly = datos.get(ticker)
             
             if df_monthly is None or len(df_monthly) < 15:
                 print(f"⚠️ {ticker}: Datos insuficientes")
@@ -197,7 +603,6 @@ def calcular_inercia_mensual():
             
         except Exception as e:
             print(f"❌ Error {ticker}: {e}")
-            import traceback
             traceback.print_exc()
     
     # Ordenar por inercia descendente
@@ -246,30 +651,61 @@ def formato_mensaje(resultados):
 # BACKTEST ROTACIONAL
 # ============================================================
 
-def ejecutar_backtest(top_n=2, start_date="2000-01-01"):
+def descargar_datos_backtest(start_date="2000-01-01"):
     """
-    Backtest rotacional mensual igual que Amibroker.
+    Descarga los datos mensuales de los ETFs y del benchmark para el backtest.
+    Retorna el dict {ticker: df_mensual} que consume ejecutar_backtest.
     """
-    print(f"\n{'='*60}")
-    print(f"📈 BACKTEST ROTACIONAL TOP {top_n}")
-    print(f"{'='*60}")
-    print(f"📅 Período: {start_date} - Hoy")
-    print(f"🔄 Rebalanceo: Mensual")
-    print(f"📊 ETFs: {', '.join(ETFS)}")
-    print(f"⚙️ Parámetros: N={N}, M={M}")
-    print()
-    
-    # Descargar todos los datos
     print("⏳ Descargando datos históricos...")
-    datos = {}
+    datos = descargar_datos_mensuales_batch(ETFS + [BENCHMARK], start=start_date)
     for ticker in ETFS + [BENCHMARK]:
-        df = descargar_datos_mensuales(ticker, start=start_date)
-        if df is not None and len(df) > 0:
-            datos[ticker] = df
+        df = datos.get(ticker)
+        if df is not None:
             print(f"  ✅ {ticker}: {len(df)} meses desde {df.index[0].strftime('%Y-%m')}")
         else:
             print(f"  ⚠️ {ticker}: Sin datos")
     
+    return datos
+
+
+def tickers_de_mascara(mascara, tickers):
+    """Decodifica una cartera en bitmask (bit j = tickers[j]) a lista de tickers."""
+    return [t for j, t in enumerate(tickers) if mascara >> j & 1]
+
+
+def version_datos(datos, tickers):
+    """
+    Identifica la versión de los datos descargados: por ticker, número de
+    meses, última fecha y último cierre.
+    
+    El histórico sí puede cambiar: Yahoo reescala todo el histórico ajustado
+    tras cada dividendo o split (ver completar_cache). Pero ese reajuste
+    también cambia el último cierre, o llega junto a una barra nueva, así
+    que en la práctica la cola basta para saber si hay que recalcular.
+    """
+    return tuple(
+        (t, len(datos[t]), datos[t].index[-1], float(datos[t]['Close'].iloc[-1]))
+        for t in tickers
+    )
+
+
+def preparar_backtest(start_date="2000-01-01", datos=None):
+    """
+    Prepara todo lo que NO depende de top_n: inercia histórica y retornos
+    mensuales, alineados con las fechas del benchmark.
+    
+    Se calcula una vez y se reutiliza en cada simulación de ejecutar_backtest.
+    
+    Args:
+        datos: dict {ticker: df_mensual} ya descargado (ver
+               descargar_datos_backtest). Si es None, se descarga aquí.
+    
+    Retorna un dict con 'fechas', 'tickers', 'scores', 'retornos' y
+    'retornos_bench', o None si no hay datos suficientes.
+    """
+    if datos is None:
+        datos = descargar_datos_backtest(start_date)
+    
     if BENCHMARK not in datos:
         print(f"❌ Error: No se pudo descargar {BENCHMARK}")
         return None
@@ -277,97 +713,130 @@ def ejecutar_backtest(top_n=2, start_date="2000-01-01"):
     benchmark_df = datos[BENCHMARK]
     fechas = benchmark_df.index[14:]
     
-    print("\n⏳ Calculando Inercia Alcista histórica...")
-    inercia_historica = {}
-    returns_historico = {}
+    disponibles = [t for t in ETFS if t in datos]
+    if not disponibles:
+        print("❌ No hay suficientes datos para el backtest")
+        return None
     
-    for ticker in ETFS:
-        if ticker not in datos:
-            continue
-        
-        df = datos[ticker]
-        inercia, _, _, _, _, _, _ = calcular_inercia_alcista(df)
-        returns_m = df['Close'].pct_change()
-        
-        inercia_historica[ticker] = inercia
-        returns_historico[ticker] = returns_m
+    # Panel (meses x tickers) con columnas (campo, ticker): una sola pasada
+    # vectorizada para todos los ETFs en lugar de un bucle por ticker
+    panel = pd.concat({t: datos[t] for t in disponibles}, axis=1).swaplevel(0, 1, axis=1)
+    
+    clave = version_datos(datos, disponibles)
+    inercia_historica = _CACHE_INERCIA.get(clave)
+    if inercia_historica is None:
+        print("\n⏳ Calculando Inercia Alcista histórica...")
+        inercia_historica, _, _, _, _, _, _ = calcular_inercia_alcista(panel)
+        # Solo interesa la versión más reciente: acota la memoria
+        _CACHE_INERCIA.clear()
+        _CACHE_INERCIA[clave] = inercia_historica
+    else:
+        print("\n♻️ Inercia Alcista histórica reutilizada (mismos datos)")
+    # Retornos en float64: se componen durante 25 años en la curva de capital
+    returns_historico = panel['Close'].astype(np.float64).pct_change(fill_method=None)
     
-    print("⏳ Ejecutando simulación...")
+    # Matriz (meses x tickers) de inercia alineada con las fechas del benchmark
+    inercia_df = inercia_historica.reindex(fechas)
     
-    portfolio_value = [100.0]
-    benchmark_value = [100.0]
-    posiciones_actuales = set()
-    trades_log = []
-    fechas_validas = []
+    # Retornos mensuales precalculados una sola vez y alineados por posición
+    # con 'fechas': la fila i+1 corresponde a fecha_siguiente
+    return {
+        'fechas': fechas,
+        'tickers': inercia_df.columns,
+        'scores': inercia_df.to_numpy(),
+        'retornos': returns_historico.reindex(fechas).to_numpy(),
+        'retornos_bench': benchmark_df['Close'].astype(np.float64).pct_change().reindex(fechas).to_numpy()
+    }
+
+
+def ejecutar_backtest(top_n=2, start_date="2000-01-01", datos=None, preparado=None):
+    """
+    Backtest rotacional mensual igual que Amibroker.
     
-    for i, fecha in enumerate(fechas[:-1]):
-        fecha_siguiente = fechas[i + 1]
-        
-        rankings = []
-        for ticker in ETFS:
-            if ticker not in inercia_historica:
-                continue
-            
-            inercia = inercia_historica[ticker]
-            if fecha not in inercia.index:
-                continue
-            
-            valor = inercia.loc[fecha]
-            if pd.notna(valor):
-                score = max(0, valor)
-                if score > 0:
-                    rankings.append((ticker, score))
-        
-        if len(rankings) < top_n:
-            continue
-        
-        fechas_validas.append(fecha_siguiente)
-        
-        rankings.sort(key=lambda x: x[1], reverse=True)
-        nuevos_top = set([r[0] for r in rankings[:top_n]])
-        
-        entradas = nuevos_top - posiciones_actuales
-        salidas = posiciones_actuales - nuevos_top
-        
-        if entradas or salidas:
-            trades_log.append({
-                'fecha': fecha_siguiente,
-                'entradas': list(entradas),
-                'salidas': list(salidas),
-                'cartera': list(nuevos_top)
-            })
-        
-        posiciones_actuales = nuevos_top
-        
-        retornos_mes = []
-        for ticker in posiciones_actuales:
-            if ticker in returns_historico:
-                ret = returns_historico[ticker]
-                if fecha_siguiente in ret.index:
-                    r = ret.loc[fecha_siguiente]
-                    if pd.notna(r):
-                        retornos_mes.append(r)
-        
-        if retornos_mes:
-            ret_portfolio = np.mean(retornos_mes)
-        else:
-            ret_portfolio = 0
-        
-        ret_bench = benchmark_df['Close'].pct_change().loc[fecha_siguiente]
-        if pd.isna(ret_bench):
-            ret_bench = 0
-        
-        portfolio_value.append(portfolio_value[-1] * (1 + ret_portfolio))
-        benchmark_value.append(benchmark_value[-1] * (1 + ret_bench))
+    Args:
+        datos: dict {ticker: df_mensual} ya descargado (ver
+               descargar_datos_backtest). Si es None, se descarga aquí.
+        preparado: resultado de preparar_backtest. Si se pasa, solo se
+                   ejecuta la simulación (ni descarga ni indicadores).
+    """
+    print(f"\n{'='*60}")
+    print(f"📈 BACKTEST ROTACIONAL TOP {top_n}")
+    print(f"{'='*60}")
+    print(f"📅 Período: {start_date} - Hoy")
+    print(f"🔄 Rebalanceo: Mensual")
+    print(f"📊 ETFs: {', '.join(ETFS)}")
+    print(f"⚙️ Parámetros: N={N}, M={M}")
+    print()
+    
+    if preparado is None:
+        preparado = preparar_backtest(start_date, datos)
+        if preparado is None:
+            return None
+    
+    fechas = preparado['fechas']
+    tickers = preparado['tickers']
+    scores = preparado['scores']
+    retornos = preparado['retornos']
+    retornos_bench = preparado['retornos_bench']
     
-    if not fechas_validas:
+    print("⏳ Ejecutando simulación...")
+    
+    # La fila i de scores decide la cartera que obtiene los retornos de la
+    # fila i+1 (fecha_siguiente): se alinean desplazando una posición
+    scores = scores[:-1]
+    retornos = retornos[1:]
+    retornos_bench = retornos_bench[1:]
+    
+    # Score = IIf(InerciaAlcista < 0, 0, InerciaAlcista): solo puntúan
+    # los > 0 (NaN > 0 es False, así que también quedan fuera). Los meses
+    # con menos de top_n ETFs válidos no se operan.
+    validos = scores > 0
+    activos = validos.sum(axis=1) >= top_n
+    
+    # Top N de cada mes de una vez: orden descendente entre los válidos
+    # (estable: a igualdad de score gana el primero en ETFS)
+    orden = np.argsort(np.where(validos, -scores, np.inf), axis=1, kind='stable')
+    en_cartera = np.zeros_like(validos)
+    np.put_along_axis(en_cartera, orden[:, :top_n], True, axis=1)
+    
+    en_cartera = en_cartera[activos]
+    retornos = retornos[activos]
+    retornos_bench = retornos_bench[activos]
+    fechas_validas = fechas[1:][activos]
+    
+    if not len(fechas_validas):
         print("❌ No hay suficientes datos para el backtest")
         return None
     
+    # Media equiponderada de los retornos disponibles (0 si no hay ninguno)
+    con_dato = en_cartera & ~np.isnan(retornos)
+    n_con_dato = con_dato.sum(axis=1)
+    suma = np.where(con_dato, retornos, 0.0).sum(axis=1)
+    ret_portfolio = np.divide(suma, n_con_dato, out=np.zeros_like(suma), where=n_con_dato > 0)
+    ret_bench = np.nan_to_num(retornos_bench, nan=0.0)
+    
+    portfolio_value = 100.0 * np.cumprod(1 + ret_portfolio)
+    benchmark_value = 100.0 * np.cumprod(1 + ret_bench)
+    
+    # Carteras como bitmask (bit j activo = tickers[j] en cartera); solo los
+    # meses con cambio generan trade y solo entonces se decodifican tickers
+    mascaras = en_cartera.astype(np.int64) @ (1 << np.arange(len(tickers), dtype=np.int64))
+    anteriores = np.concatenate(([0], mascaras[:-1]))
+    trades_log = []
+    for k in np.flatnonzero(mascaras != anteriores):
+        nueva_cartera = int(mascaras[k])
+        cartera_actual = int(anteriores[k])
+        trades_log.append({
+            'fecha': fechas_validas[k],
+            'entradas': tickers_de_mascara(nueva_cartera & ~cartera_actual, tickers),
+            'salidas': tickers_de_mascara(cartera_actual & ~nueva_cartera, tickers),
+            'cartera': tickers_de_mascara(nueva_cartera, tickers)
+        })
+    
     resultados = pd.DataFrame({
         'Fecha': fechas_validas,
-        'Portfolio': portfolio_value[1:len(fechas_validas)+1],
-        'Benchmark': benchmark_value[1:len(fechas_validas)+1]
+        'Portfolio': portfolio_value,
+        'Benchmark': benchmark_value
     }).set_index('Fecha')
     
     metricas = calcular_metricas(resultados, trades_log, top_n)
@@ -375,34 +844,45 @@ def ejecutar_backtest(top_n=2, start_date="2000-01-01"):
     return metricas
 
 
-def calcular_metricas(resultados, trades_log, top_n):
-    """Calcula CAGR, Max Drawdown y Sharpe Ratio."""
-    
-    años = (resultados.index[-1] - resultados.index[0]).days / 365.25
-    
-    valor_inicial_p = resultados['Portfolio'].iloc[0]
-    valor_final_p = resultados['Portfolio'].iloc[-1]
+def metricas_curva(valores, años):
+    """
+    Calcula valor final, CAGR, Max Drawdown y Sharpe de curvas de capital
+    directamente sobre el ndarray, sin Series intermedias.
     
-    cagr_p = ((valor_final_p / valor_inicial_p) ** (1 / años) - 1) * 100
+    Acepta una curva (1-D) o varias a la vez (meses x curvas): cada métrica
+    sale de una sola pasada por columnas.
+    """
+    valor_inicial = valores[0]
+    valor_final = valores[-1]
     
-    rolling_max_p = resultados['Portfolio'].cummax()
-    drawdown_p = (resultados['Portfolio'] - rolling_max_p) / rolling_max_p
-    max_dd_p = drawdown_p.min() * 100
+    cagr = ((valor_final / valor_inicial) ** (1 / años) - 1) * 100
     
-    returns_p = resultados['Portfolio'].pct_change().dropna()
-    sharpe_p = (returns_p.mean() / returns_p.std()) * np.sqrt(12) if returns_p.std() > 0 else 0
+    rolling_max = np.maximum.accumulate(valores, axis=0)
+    max_dd = ((valores - rolling_max) / rolling_max).min(axis=0) * 100
     
-    valor_inicial_b = resultados['Benchmark'].iloc[0]
-    valor_final_b = resultados['Benchmark'].iloc[-1]
+    # Retornos simples mensuales; ddof=1 igual que pandas .std()
+    sharpe = np.zeros_like(valor_final)
+    returns = valores[1:] / valores[:-1] - 1
+    if len(returns) > 1:
+        std = returns.std(axis=0, ddof=1)
+        np.divide(returns.mean(axis=0) * np.sqrt(12), std, out=sharpe, where=std > 0)
     
-    cagr_b = ((valor_final_b / valor_inicial_b) ** (1 / años) - 1) * 100
+    return valor_final, cagr, max_dd, sharpe
+
+
+def calcular_metricas(resultados, trades_log, top_n):
+    """Calcula CAGR, Max Drawdown y Sharpe Ratio."""
     
-    rolling_max_b = resultados['Benchmark'].cummax()
-    drawdown_b = (resultados['Benchmark'] - rolling_max_b) / rolling_max_b
-    max_dd_b = drawdown_b.min() * 100
+    años = (resultados.index[-1] - resultados.index[0]).days / 365.25
     
-    returns_b = resultados['Benchmark'].pct_change().dropna()
-    sharpe_b = (returns_b.mean() / returns_b.std()) * np.sqrt(12) if returns_b.std() > 0 else 0
+    # Estrategia y benchmark en la misma pasada (columna 0 y 1)
+    valor_final, cagr, max_dd, sharpe = metricas_curva(
+        resultados[['Portfolio', 'Benchmark']].to_numpy(), años
+    )
+    valor_final_p, valor_final_b = valor_final
+    cagr_p, cagr_b = cagr
+    max_dd_p, max_dd_b = max_dd
+    sharpe_p, sharpe_b = sharpe
     
     print(f"\n{'='*60}")
     print(f"📊 RESULTADOS BACKTEST TOP {top_n}")
@@ -447,18 +927,45 @@ def calcular_metricas(resultados, trades_log, top_n):
 
 
 def backtest_completo():
-    """Ejecuta backtest para TOP 2 y TOP 3."""
+    """
+    Ejecuta backtest para TOP 2 y TOP 3.
+    
+    El resultado se memoriza por día UTC, como calcular_inercia_mensual:
+    el bot de Telegram puede pedirlo varias veces sin volver a simularlo.
+    """
+    hoy_utc = datetime.now(timezone.utc).date()
+    if hoy_utc in _CACHE_BACKTEST:
+        print(f"♻️ Backtest ya calculado hoy ({hoy_utc.strftime('%d/%m/%Y')} UTC)")
+        return dict(_CACHE_BACKTEST[hoy_utc])
+    
+    resultados = _backtest_completo()
+    
+    # Solo se guarda el del día: el de ayer ya no sirve
+    _CACHE_BACKTEST.clear()
+    if 'top2' in resultados and 'top3' in resultados:
+        _CACHE_BACKTEST[hoy_utc] = resultados
+    
+    return dict(resultados)
+
+
+def _backtest_completo():
+    """Descarga, prepara y simula TOP 2 y TOP 3. Ver backtest_completo."""
     print("\n" + "="*70)
     print("🚀 BACKTEST ROTACIONAL - INERCIA ALCISTA")
     print("="*70)
     
     resultados = {}
     
-    res_top2 = ejecutar_backtest(top_n=2, start_date="2000-01-01")
+    # Descarga e indicadores una sola vez; cada TOP N solo simula
+    preparado = preparar_backtest(start_date="2000-01-01")
+    if preparado is None:
+        return resultados
+    
+    res_top2 = ejecutar_backtest(top_n=2, start_date="2000-01-01", preparado=preparado)
     if res_top2:
         resultados['top2'] = res_top2
     
-    res_top3 = ejecutar_backtest(top_n=3, start_date="2000-01-01")
+    res_top3 = ejecutar_backtest(top_n=3, start_date="2000-01-01", preparado=preparado)
     if res_top3:
         resultados['top3'] = res_top3
     
@@ -1,5 +1,3 @@
-### 📄 `main.py`
-```python
 import json, os, asyncio
 from telegram_bot import start_bot
 
@@ -17,4 +15,4 @@ def init_config():
 
 if __name__ == "__main__":
     init_config()
-    asyncio.run(start_bot())
+    asyncio.run(start_bot(CONFIG_FILE))
@@ -1,25 +1,34 @@
 import os
+import json
 import asyncio
 from telegram import Bot
+from telegram.ext import Application
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 from inercia import calcular_inercia_mensual, formato_mensaje, backtest_completo
 
-async def send_results(include_backtest=True):
+async def send_results(include_backtest=True, bot=None, chat_id=None):
     """
     Envía los resultados por Telegram.
     
     Args:
         include_backtest: Si True, envía también el backtest. Default: True
+        bot: Bot ya inicializado (p. ej. application.bot), reutilizado entre
+             envíos. Si es None, se abre uno con la variable TOKEN solo
+             para esta llamada.
+        chat_id: Chat destino. Si es None, se lee la variable CHAT_ID.
     """
     
     token = os.environ.get('TOKEN')
-    chat_id = os.environ.get('CHAT_ID')
+    if chat_id is None:
+        chat_id = os.environ.get('CHAT_ID')
     
     # Variable de entorno para controlar backtest
     skip_backtest = os.environ.get('SKIP_BACKTEST', '0') == '1'
     if skip_backtest:
         include_backtest = False
     
-    if not token:
+    if bot is None and not token:
         print("❌ Error: Variable TOKEN no configurada")
         return False
     
@@ -28,40 +37,13 @@ async def send_results(include_backtest=True):
         return False
     
     try:
-        bot = Bot(token=token)
-        
-        # === 1. ENVIAR INERCIA ACTUAL ===
-        print("🔄 Calculando inercia actual...")
-        resultados = calcular_inercia_mensual()
-        mensaje_inercia = formato_mensaje(resultados)
-        
-        print("📤 Enviando inercia a Telegram...")
-        await bot.send_message(
-            chat_id=chat_id,
-            text=mensaje_inercia,
-            parse_mode='Markdown'
-        )
-        print("✅ Inercia enviada!")
-        
-        # === 2. ENVIAR BACKTEST (opcional) ===
-        if include_backtest:
-            print("\n🔄 Ejecutando backtest...")
-            backtest_res = backtest_completo()
-            
-            if backtest_res and 'top2' in backtest_res and 'top3' in backtest_res:
-                mensaje_backtest = formato_backtest(backtest_res)
-                
-                print("📤 Enviando backtest a Telegram...")
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=mensaje_backtest,
-                    parse_mode='Markdown'
-                )
-                print("✅ Backtest enviado!")
-            else:
-                print("⚠️ No se pudo generar el backtest")
+        if bot is not None:
+            await _enviar_resultados(bot, chat_id, include_backtest)
         else:
-            print("⏭️ Backtest omitido (SKIP_BACKTEST=1)")
+            # Bot propio de esta llamada: su cliente HTTPX se abre y se
+            # cierra en este mismo event loop
+            async with Bot(token=token) as bot:
+                await _enviar_resultados(bot, chat_id, include_backtest)
         
         return True
         
@@ -70,6 +52,82 @@ async def send_results(include_backtest=True):
         return False
 
 
+async def _enviar_resultados(bot, chat_id, include_backtest):
+    """Calcula y envía la inercia actual y, opcionalmente, el backtest."""
+    
+    # === 1. ENVIAR INERCIA ACTUAL ===
+    print("🔄 Calculando inercia actual...")
+    resultados = calcular_inercia_mensual()
+    mensaje_inercia = formato_mensaje(resultados)
+    
+    print("📤 Enviando inercia a Telegram...")
+    await bot.send_message(
+        chat_id=chat_id,
+        text=mensaje_inercia,
+        parse_mode='Markdown'
+    )
+    print("✅ Inercia enviada!")
+    
+    # === 2. ENVIAR BACKTEST (opcional) ===
+    if include_backtest:
+        print("\n🔄 Ejecutando backtest...")
+        backtest_res = backtest_completo()
+        
+        if backtest_res and 'top2' in backtest_res and 'top3' in backtest_res:
+            mensaje_backtest = formato_backtest(backtest_res)
+            
+            print("📤 Enviando backtest a Telegram...")
+            await bot.send_message(
+                chat_id=chat_id,
+                text=mensaje_backtest,
+                parse_mode='Markdown'
+            )
+            print("✅ Backtest enviado!")
+        else:
+            print("⚠️ No se pudo generar el backtest")
+    else:
+        print("⏭️ Backtest omitido (SKIP_BACKTEST=1)")
+
+
+async def start_bot(config_file="config.json"):
+    """
+    Arranca el envío programado: una sola Application y un AsyncIOScheduler
+    que llama a send_results el último día de cada mes a las 22:00 UTC
+    (igual que el workflow). La configuración se lee una vez y cada envío
+    reutiliza application.bot, sin crear otro Bot por ejecución.
+    """
+    try:
+        with open(config_file) as f:
+            cfg = json.load(f)
+    except Exception as e:
+        print(f"⚠️ No se pudo leer {config_file} ({e})")
+        cfg = {}
+    
+    token = cfg.get('token') or os.environ.get('TOKEN')
+    chat_id = cfg.get('chat_id') or os.environ.get('CHAT_ID')
+    
+    if not token or not chat_id:
+        print("❌ Error: Falta token o chat_id (config.json o TOKEN/CHAT_ID)")
+        return
+    
+    application = Application.builder().token(token).build()
+    
+    scheduler = AsyncIOScheduler(timezone="UTC")
+    scheduler.add_job(
+        send_results,
+        CronTrigger(day='last', hour=22, minute=0, timezone="UTC"),
+        kwargs={'bot': application.bot, 'chat_id': chat_id}
+    )
+    
+    async with application:
+        scheduler.start()
+        print("🤖 Bot activo: envío el último día de cada mes (22:00 UTC)")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            scheduler.shutdown(wait=False)
+
+
 def formato_backtest(resultados):
     """Formatea los resultados del backtest para Telegram."""
     